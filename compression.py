@@ -0,0 +1,105 @@
+# compression.py
+import zlib
+
+COMPRESSIBLE_TYPES = ("text/html", "application/json", "text/event-stream")
+MINIMUM_SIZE = 500
+
+
+class CompressionMiddleware:
+    """
+    Middleware ASGI gzip pour HTML, JSON et SSE.
+    Contrairement au GZipMiddleware de Starlette, chaque chunk d'un flux est
+    vidé (Z_SYNC_FLUSH) pour que les événements SSE arrivent sans attendre.
+    """
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _accepts_gzip(scope):
+            await self.app(scope, receive, send)
+            return
+        responder = _GzipResponder(send, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+def _accepts_gzip(scope: dict) -> bool:
+    """gzip accepté si listé (ou via `*`) avec q > 0 ; tous les headers Accept-Encoding sont lus."""
+    qvalues = {}
+    for k, v in scope.get("headers", []):
+        if k.lower() != b"accept-encoding":
+            continue
+        for item in v.decode("latin-1").split(","):
+            coding, _, params = item.strip().partition(";")
+            coding = coding.strip().lower()
+            if not coding:
+                continue
+            q = 1.0
+            for param in params.split(";"):
+                name, _, value = param.strip().partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            qvalues[coding] = q
+    if "gzip" in qvalues:
+        return qvalues["gzip"] > 0
+    return qvalues.get("*", 0.0) > 0
+
+
+class _GzipResponder:
+    def __init__(self, send, minimum_size: int):
+        self._send = send
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.passthrough = False
+        self.streaming = False
+        self.compressor = None
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = {k.lower(): v for k, v in message.get("headers", [])}
+            ctype = headers.get(b"content-type", b"").decode("latin-1")
+            self.passthrough = (
+                b"content-encoding" in headers
+                or message["status"] in (204, 304)
+                or not ctype.startswith(COMPRESSIBLE_TYPES)
+            )
+            if self.passthrough:
+                await self._send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.streaming:
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self.streaming = True
+            await self._send(self._compressed_start())
+
+        data = self.compressor.compress(body)
+        data += self.compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    def _compressed_start(self) -> dict:
+        headers = [
+            (k, v) for k, v in self.start_message.get("headers", [])
+            if k.lower() != b"content-length"
+        ]
+        vary = [v for k, v in headers if k.lower() == b"vary"]
+        headers = [(k, v) for k, v in headers if k.lower() != b"vary"]
+        vary_value = b", ".join(vary + [b"Accept-Encoding"]) if vary else b"Accept-Encoding"
+        headers += [(b"content-encoding", b"gzip"), (b"vary", vary_value)]
+        return {**self.start_message, "headers": headers}
@@ -1,9 +1,10 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, RedirectResponse, Response
 from pydantic import BaseModel
 import random
 import json
+import hashlib
+import uuid
 from typing import Optional
 import asyncio
 from fastapi.responses import StreamingResponse
@@ -11,9 +12,13 @@ from fastapi.responses import StreamingResponse
 from environment import get_environment_state
 from skale_payment import send_payment, address
 from agent import detect_crisis, investment_policy_explain, should_buy_premium_signal
+from profiler import ProfilingMiddleware, profiled, is_admin, list_profiles, profile_path, PROFILE_DIR, PROFILE_SAMPLE_RATE
+from compression import CompressionMiddleware
+from signal_market import SignalMarketplace, SignalProvider, default_local_providers, LOCAL_SIGNAL_PROVIDERS
 
 app = FastAPI(title="AI Energy Capital Entity — SKALE x402")
-templates = Jinja2Templates(directory="templates")
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(CompressionMiddleware)
 
 # ---------- Models ----------
 class EpochRequest(BaseModel):
@@ -36,6 +41,10 @@ portfolio = {
 
 valid_transactions: set[str] = set()
 
+# Bumped on every state mutation; drives the /dashboard/state ETag (per worker process)
+STATE_BOOT_ID = uuid.uuid4().hex[:8]
+STATE_VERSION = 0
+
 # ---------- Finance tuning ----------
 ASSET_VALUE_MULTIPLIER = 0.004
 DEPLOY_COST = 0.5
@@ -47,6 +56,8 @@ OPEX_PER_ASSET = 0.01
 # ---------- Info marketplace ----------
 PREMIUM_COST = 0.05
 PROVIDER_ADDRESS = address
+PREMIUM_MIN_CASH_BUFFER = 0.20
+signal_market = SignalMarketplace()
 
 # ---------- Optional: one-shot forced crisis for demo ----------
 FORCE_NEXT_CRISIS = None
@@ -90,21 +101,15 @@ def simulate_premium_forecast(state: dict) -> dict:
     price_premium = price_true * (1 + random.uniform(-0.02, 0.02))
     return {"solar": max(solar_premium, 0.0), "price": max(price_premium, 0.0)}
 
-def estimate_evpi(state: dict, basic: dict, premium: dict) -> float:
-    delta_solar = abs(basic["solar"] - state["solar_production"]) - abs(premium["solar"] - state["solar_production"])
-    delta_price = abs(basic["price"] - state["energy_price"]) - abs(premium["price"] - state["energy_price"])
-    info_gain = max(0.0, (0.6 * delta_solar + 1.0 * delta_price)) * 0.08
-    expected_penalty_avoid = 0.20
-    return round(info_gain + expected_penalty_avoid, 4)
-
 def reset_simulation():
-    global MARKET_STRESS
+    global MARKET_STRESS, STATE_VERSION
     portfolio["cash"] = 1.0
     portfolio["assets"] = [{"id": "SOLAR-1", "type": "solar", "capacity_kw": 100.0, "efficiency": 0.85, "acquisition_cost": 0.5}]
     portfolio["nav_history"] = []
     portfolio["info_spend_total"] = 0.0
     portfolio["last_deploy_step"] = None
     MARKET_STRESS = 1.0
+    STATE_VERSION += 1
 
 # ---------- Cinematic run state ----------
 CINEMATIC_LAST = {
@@ -131,6 +136,7 @@ def _mk_story_event(label: str, epoch: dict) -> dict:
         "asset_count": epoch.get("asset_count"),
         "tx_hash": epoch.get("tx_hash"),
         "premium_tx": epoch.get("premium_tx"),
+        "signal_provider": epoch.get("signal_provider"),
     }
 
 def _compute_cinematic_summary(story: list[dict]) -> dict:
@@ -196,33 +202,13 @@ def cinematic_stream(risk_tolerance: float = 0.7):
         ]
 
         for label, cfg in steps:
-            epoch = _run_epoch_internal(rt, force_crisis=cfg["force"])
+            # hors de la boucle d'événements : achat de signal (deadline) et tx on-chain bloquent
+            epoch = await asyncio.to_thread(_run_epoch_internal, rt, cfg["force"])
             payload = _mk_story_event(label, epoch)
             payload["type"] = "epoch"
             
             # ✅ Dashboard update
-            payload["dashboard_update"] = {
-                "current_nav": round(epoch["nav"], 4),
-                "hwm": round(epoch["hwm"], 4),
-                "drawdown": round(epoch["drawdown"], 4),
-                "regime": epoch["regime"],
-                "crisis": epoch["crisis"],
-                "survival_mode": epoch["survival_mode"],
-                "cash": round(portfolio["cash"], 4),
-                "asset_count": len(portfolio["assets"]),
-                "total_capacity": round(sum(a["capacity_kw"] for a in portfolio["assets"]), 1),
-                "last_assets": portfolio["assets"][-3:],
-                "decision": epoch["decision"],
-                "tx_hash": epoch.get("tx_hash"),
-                "used_premium": epoch["used_premium"],
-                "evpi": round(epoch["evpi"], 4),
-                "info_spend": round(epoch["info_spend"], 4),
-                "net_edge": round(epoch["net_edge"], 4),
-                "info_spend_total": round(portfolio["info_spend_total"], 4),
-                "premium_tx": epoch.get("premium_tx"),
-                "rationale": epoch.get("rationale", []),
-                "policy_meta": epoch.get("policy_meta", {}),
-            }
+            payload["dashboard_update"] = _dashboard_payload(epoch)
             
             # ✅ Chart update
             payload["chart_update"] = {
@@ -235,7 +221,7 @@ def cinematic_stream(risk_tolerance: float = 0.7):
             await asyncio.sleep(0.15)
 
         yield sse({"type": "status", "message": "⛓️ Sending SKALE settlement transaction..."})
-        settle = run_demo()
+        settle = await asyncio.to_thread(run_demo)
         yield sse({"type": "settlement", "result": settle})
 
         story = portfolio["nav_history"]
@@ -276,7 +262,11 @@ def cinematic_stream(risk_tolerance: float = 0.7):
         })
         yield sse({"type": "done"})
 
-    return StreamingResponse(event_gen(), media_type="text/event-stream")
+    return StreamingResponse(
+        event_gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # ---------- Payment / x402 ----------
 @app.post("/x402/pay")
@@ -293,11 +283,9 @@ def x402_pay():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/premium/signal")
-def premium_signal(tx_hash: str | None = None):
+def _paid_premium_signal(tx_hash: str | None, state: dict) -> dict:
     if not tx_hash or tx_hash not in valid_transactions:
         raise HTTPException(status_code=402, detail="Payment Required (x402)")
-    state = get_environment_state()
     premium = simulate_premium_forecast(state)
     return {
         "status": "ok",
@@ -305,6 +293,38 @@ def premium_signal(tx_hash: str | None = None):
         "provider_signature": "signed_by_skale_oracle_demo"
     }
 
+@app.get("/premium/signal")
+def premium_signal(tx_hash: str | None = None):
+    return _paid_premium_signal(tx_hash, get_environment_state())
+
+def _skale_oracle_fetch(state: dict) -> tuple[dict, str]:
+    pay = x402_pay()
+    try:
+        ps = _paid_premium_signal(pay["tx_hash"], state)
+    except Exception as e:
+        # payé mais signal non livré : le marketplace doit quand même facturer
+        e.tx_hash = pay["tx_hash"]
+        raise
+    return ps["data"], pay["tx_hash"]
+
+signal_market.register(SignalProvider(
+    "skale-oracle",
+    price=PREMIUM_COST,
+    fetch_fn=_skale_oracle_fetch,
+    address=PROVIDER_ADDRESS,
+    latency_hint=1.5,
+    error_hint=(0.015, 0.01),
+    kind="x402",
+    pay_per_call=False,
+))
+if LOCAL_SIGNAL_PROVIDERS:
+    for _p in default_local_providers():
+        signal_market.register(_p)
+
+@app.get("/signals/providers")
+def signal_providers():
+    return signal_market.snapshot()
+
 @app.post("/force_crisis/{crisis_type}")
 def force_crisis(crisis_type: str):
     global FORCE_NEXT_CRISIS
@@ -314,37 +334,48 @@ def force_crisis(crisis_type: str):
     return {"status": "ok", "next_crisis": FORCE_NEXT_CRISIS}
 
 # ---------- Core: single epoch ----------
+@profiled
 def _run_epoch_internal(risk_tolerance: float, force_crisis: Optional[str] = None) -> dict:
-    global MARKET_STRESS, FORCE_NEXT_CRISIS
+    global MARKET_STRESS, FORCE_NEXT_CRISIS, STATE_VERSION
     risk_tolerance = max(0.0, min(1.0, risk_tolerance))
     if force_crisis in ["grid_failure", "cloud_cover", "price_crash"]:
         FORCE_NEXT_CRISIS = force_crisis
     state = get_environment_state()
     basic = simulate_basic_forecast(state)
-    premium = simulate_premium_forecast(state)
-    evpi = estimate_evpi(state, basic, premium)
+    quotes = signal_market.quotes(basic)
+    best = quotes[0] if quotes else None
+    evpi = best.evpi if best else 0.0
     used_premium = False
-    info_spend = 0.0
+    # x402 réglés après la deadline d'un epoch précédent
+    info_spend = signal_market.drain_late_charges()
+    portfolio["cash"] = max(0.0, portfolio["cash"] - info_spend)
+    portfolio["info_spend_total"] += info_spend
     premium_tx = None
-    if should_buy_premium_signal(
+    signal_provider = None
+    signal_latency = None
+    signal_hedged = False
+    if best and should_buy_premium_signal(
         cash=portfolio["cash"],
-        premium_cost=PREMIUM_COST,
+        premium_cost=best.price,
         evpi=evpi,
         risk_tolerance=risk_tolerance,
-        min_cash_buffer=0.20
+        min_cash_buffer=PREMIUM_MIN_CASH_BUFFER
     ):
-        pay = x402_pay()
-        premium_tx = pay["tx_hash"]
-        try:
-            ps = premium_signal(tx_hash=premium_tx)
-            premium_data = ps["data"]
+        purchase = signal_market.purchase(
+            quotes, state, max_spend=portfolio["cash"] - PREMIUM_MIN_CASH_BUFFER
+        )
+        # stand-ins : chaque requête lancée est facturée ; x402 : seulement si payé
+        info_spend = round(info_spend + purchase.spent, 4)
+        portfolio["cash"] = max(0.0, portfolio["cash"] - purchase.spent)
+        portfolio["info_spend_total"] += purchase.spent
+        signal_latency = purchase.latency
+        signal_hedged = purchase.hedges > 0
+        if purchase.data is not None:
             used_premium = True
-            info_spend = PREMIUM_COST
-            portfolio["cash"] = max(0.0, portfolio["cash"] - PREMIUM_COST)
-            portfolio["info_spend_total"] += PREMIUM_COST
-            basic = premium_data
-        except Exception:
-            used_premium = False
+            premium_tx = purchase.tx_hash
+            evpi = purchase.quote.evpi
+            signal_provider = purchase.quote.provider.name
+            basic = purchase.data
     crisis = detect_crisis(force=FORCE_NEXT_CRISIS)
     FORCE_NEXT_CRISIS = None
     if crisis:
@@ -435,12 +466,16 @@ def _run_epoch_internal(risk_tolerance: float, force_crisis: Optional[str] = Non
         "net_edge": net_edge,
         "info_spend_total": round(portfolio["info_spend_total"], 4),
         "premium_tx": premium_tx,
+        "signal_provider": signal_provider,
+        "signal_latency_s": signal_latency,
+        "signal_hedged": signal_hedged,
         "market_stress": round(MARKET_STRESS, 4),
         "regime": get_market_regime(MARKET_STRESS),
         "forecast_solar": round(basic["solar"], 3),
         "forecast_price": round(basic["price"], 4),
     }
     portfolio["nav_history"].append(epoch)
+    STATE_VERSION += 1
     return epoch
 
 @app.post("/epoch")
@@ -463,8 +498,50 @@ def run_demo():
         return {"status": "error", "message": f"❌ Error: {str(e)}"}
 
 # ---------- Dashboard ----------
-@app.get("/dashboard", response_class=HTMLResponse)
-def dashboard():
+# Static shell: read once, served under a content-hashed URL with long-lived caching.
+# Live data comes from /dashboard/state.
+with open("static/dashboard.html", "rb") as f:
+    DASHBOARD_SHELL = f.read()
+DASHBOARD_VERSION = hashlib.sha256(DASHBOARD_SHELL).hexdigest()[:12]
+DASHBOARD_ETAG = f'W/"shell-{DASHBOARD_VERSION}"'
+# /dashboard/state reste petit : seuls les champs du graphe, sur les derniers points
+DASHBOARD_HISTORY_POINTS = 50
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == wanted for t in if_none_match.split(","))
+
+def _dashboard_payload(epoch: dict) -> dict:
+    return {
+        "current_nav": round(epoch["nav"], 4),
+        "hwm": round(epoch["hwm"], 4),
+        "drawdown": round(epoch["drawdown"], 4),
+        "regime": epoch["regime"],
+        "crisis": epoch["crisis"],
+        "survival_mode": epoch["survival_mode"],
+        "cash": round(portfolio["cash"], 4),
+        "asset_count": len(portfolio["assets"]),
+        "total_capacity": round(sum(a["capacity_kw"] for a in portfolio["assets"]), 1),
+        "last_assets": portfolio["assets"][-3:],
+        "decision": epoch["decision"],
+        "tx_hash": epoch.get("tx_hash"),
+        "used_premium": epoch["used_premium"],
+        "evpi": round(epoch["evpi"], 4),
+        "info_spend": round(epoch["info_spend"], 4),
+        "net_edge": round(epoch["net_edge"], 4),
+        "info_spend_total": round(portfolio["info_spend_total"], 4),
+        "premium_tx": epoch.get("premium_tx"),
+        "signal_provider": epoch.get("signal_provider"),
+        "rationale": epoch.get("rationale", []),
+        "policy_meta": epoch.get("policy_meta", {}),
+    }
+
+@profiled
+def _dashboard_state() -> dict:
     nav_history = portfolio["nav_history"]
     current_nav = calculate_nav(MARKET_STRESS)
     if nav_history:
@@ -478,29 +555,75 @@ def dashboard():
             "crisis": "✅ Stable Operations",
             "survival_mode": False,
             "decision": "hold_cash",
-            "cash": portfolio["cash"],
-            "asset_count": len(portfolio["assets"]),
             "tx_hash": None,
-            "market_stress": MARKET_STRESS,
             "regime": get_market_regime(MARKET_STRESS),
             "used_premium": False,
             "evpi": 0.0,
             "info_spend": 0.0,
             "net_edge": 0.0,
-            "info_spend_total": portfolio["info_spend_total"],
             "premium_tx": None,
             "rationale": [],
             "policy_meta": {}
         }
-    context = {
-        "request": {},
-        "current_nav": f"{current_nav:.4f}",
-        "max_nav": f"{last_epoch['hwm']:.4f}",
-        "cash": f"{portfolio['cash']:.4f}",
-        "asset_count": len(portfolio["assets"]),
-        "total_capacity": f"{sum(a['capacity_kw'] for a in portfolio['assets']):.1f}",
-        "last_assets": portfolio["assets"][-3:],
-        "last_epoch": last_epoch,
-        "nav_history_json": json.dumps(nav_history),
+    dash = _dashboard_payload(last_epoch)
+    dash["current_nav"] = current_nav
+    return {
+        "version": STATE_VERSION,
+        "step": last_epoch["step"],
+        "dashboard": dash,
+        "nav_history": [
+            {"step": e["step"], "nav": e["nav"], "hwm": e["hwm"], "regime": e["regime"]}
+            for e in nav_history[-DASHBOARD_HISTORY_POINTS:]
+        ],
+    }
+
+@app.get("/dashboard")
+def dashboard():
+    return RedirectResponse(
+        f"/dashboard/shell/{DASHBOARD_VERSION}",
+        status_code=307,
+        headers={"Cache-Control": "no-cache"},
+    )
+
+@app.get("/dashboard/shell/{version}", response_class=HTMLResponse)
+def dashboard_shell(version: str, if_none_match: str | None = Header(default=None)):
+    if version != DASHBOARD_VERSION:
+        return RedirectResponse(f"/dashboard/shell/{DASHBOARD_VERSION}", status_code=307)
+    headers = {
+        "ETag": DASHBOARD_ETAG,
+        "Cache-Control": "public, max-age=31536000, immutable",
     }
-    return templates.TemplateResponse("dashboard.html", context)
\ No newline at end of file
+    if _etag_matches(if_none_match, DASHBOARD_ETAG):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(DASHBOARD_SHELL, headers=headers)
+
+@app.get("/dashboard/state")
+def dashboard_state(if_none_match: str | None = Header(default=None)):
+    etag = f'W/"state-{STATE_BOOT_ID}-{STATE_VERSION}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(_dashboard_state(), headers=headers)
+
+# ---------- Admin: profiles ----------
+def _require_admin(token: str | None):
+    if not is_admin(token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/admin/profiles")
+def admin_profiles(x_admin_token: str | None = Header(default=None)):
+    _require_admin(x_admin_token)
+    return {
+        "profile_dir": PROFILE_DIR,
+        "sample_rate": PROFILE_SAMPLE_RATE,
+        "format": "pstats",
+        "profiles": list_profiles(),
+    }
+
+@app.get("/admin/profiles/{name}")
+def admin_profile_download(name: str, x_admin_token: str | None = Header(default=None)):
+    _require_admin(x_admin_token)
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
\ No newline at end of file
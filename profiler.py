@@ -0,0 +1,199 @@
+# profiler.py
+import asyncio
+import cProfile
+import hmac
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.0"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+# Sans token admin, le profilage à la demande (header / query) est désactivé
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+PROFILE_HEADER = "x-profile"
+ADMIN_HEADER = "x-admin-token"
+
+_current_session: ContextVar["ProfileSession | None"] = ContextVar("profile_session", default=None)
+
+
+class ProfileSession:
+    """
+    Profil cProfile d'une requête : seules les sections marquées
+    (@profiled / profile_section) sont capturées. cProfile ne suit que le
+    thread qui l'active, d'où un profil par thread, fusionnés au dump.
+    """
+
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = time.time()
+        self.profiles: dict[int, cProfile.Profile] = {}
+        self.sections: list[str] = []
+        self._lock = threading.Lock()
+        self._depth: dict[int, int] = {}
+
+    def filename(self) -> str:
+        slug = re.sub(r"[^a-zA-Z0-9]+", "_", self.path).strip("_") or "root"
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(self.started_at))
+        return f"{stamp}_{self.method.lower()}_{slug}_{self.trigger}_{self.id}.prof"
+
+    def dump(self) -> str | None:
+        if not self.sections:
+            return None
+        with self._lock:
+            # un thread encore en section (ex. hedge en retard) est ignoré
+            done = [p for tid, p in self.profiles.items() if self._depth.get(tid, 0) == 0]
+        if not done:
+            return None
+        stats = pstats.Stats(done[0])
+        for prof in done[1:]:
+            stats.add(prof)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, self.filename())
+        stats.dump_stats(path)
+        _prune_profiles()
+        return path
+
+
+def is_admin(token: str | None) -> bool:
+    if not ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def _profile_trigger(scope: dict) -> str | None:
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    # Token uniquement via header (jamais en query : il finirait dans les logs)
+    token = headers.get(ADMIN_HEADER)
+    requested = headers.get(PROFILE_HEADER) == "1" or (query.get("profile") or [None])[0] == "1"
+    if requested and is_admin(token):
+        return "admin"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI : ouvre une session de profilage si la requête la demande
+    (admin) ou tombe dans l'échantillon, et l'écrit en .prof une fois la
+    réponse entièrement envoyée (y compris les flux SSE).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trigger = _profile_trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+        session = ProfileSession(scope.get("method", "GET"), scope.get("path", "/"), trigger)
+        token = _current_session.set(session)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_session.reset(token)
+            # fusion pstats + écriture + purge : hors de la boucle d'événements
+            try:
+                await asyncio.to_thread(session.dump)
+            except Exception:
+                logger.exception("profile dump failed (%s %s)", session.method, session.path)
+
+
+@contextmanager
+def profile_section(name: str):
+    """
+    Active cProfile autour du bloc si une session est ouverte (sections
+    imbriquées ignorées). Dans un pool de threads, soumettre la tâche via
+    contextvars.copy_context().run pour que la session y soit visible.
+    """
+    session = _current_session.get()
+    if session is None:
+        yield
+        return
+    tid = threading.get_ident()
+    with session._lock:
+        depth = session._depth.get(tid, 0)
+        session._depth[tid] = depth + 1
+        if depth == 0:
+            prof = session.profiles.setdefault(tid, cProfile.Profile())
+            session.sections.append(name)
+    if depth > 0:
+        try:
+            yield
+        finally:
+            with session._lock:
+                session._depth[tid] -= 1
+        return
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        with session._lock:
+            session._depth[tid] -= 1
+
+
+def profiled(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with profile_section(fn.__qualname__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _prune_profiles():
+    files = sorted(
+        (os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR) if f.endswith(".prof")),
+        key=os.path.getmtime,
+    )
+    for path in files[:max(0, len(files) - PROFILE_MAX_FILES)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def list_profiles() -> list[dict]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    out = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith(".prof"):
+            continue
+        st = os.stat(os.path.join(PROFILE_DIR, name))
+        out.append({
+            "name": name,
+            "size_bytes": st.st_size,
+            "created_at": round(st.st_mtime, 3),
+        })
+    out.sort(key=lambda p: p["created_at"], reverse=True)
+    return out
+
+
+def profile_path(name: str) -> str | None:
+    if os.path.basename(name) != name or not name.endswith(".prof"):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,400 @@
+# signal_market.py
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Optional
+
+from profiler import profile_section
+
+SIGNAL_LATENCY_BUDGET = float(os.getenv("SIGNAL_LATENCY_BUDGET", "2.5"))  # secondes par epoch
+SIGNAL_MAX_HEDGES = int(os.getenv("SIGNAL_MAX_HEDGES", "1"))
+SIGNAL_EXPLORE_RATE = float(os.getenv("SIGNAL_EXPLORE_RATE", "0.1"))
+# Stand-ins simulés : démo / tests uniquement, jamais par défaut en production
+LOCAL_SIGNAL_PROVIDERS = os.getenv("LOCAL_SIGNAL_PROVIDERS", "false").lower() == "true"
+
+# Erreur relative moyenne du forecast gratuit (bruit uniforme ±20% / ±12%)
+BASIC_SOLAR_ERR = 0.10
+BASIC_PRICE_ERR = 0.06
+EXPECTED_PENALTY_AVOID = 0.20
+
+EWMA_ALPHA = 0.2
+LATENCY_WINDOW = 50
+# Au-delà, un échantillon de latence est oublié : un fournisseur lent une fois redevient candidat
+LATENCY_TTL = float(os.getenv("SIGNAL_LATENCY_TTL", "60"))
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="signal")
+
+
+class SignalProvider:
+    """
+    Fournisseur de signal premium. `fetch_fn(state)` renvoie (forecast, tx_hash).
+    Latence, taux d'échec et précision sont suivis en ligne (EWMA).
+    pay_per_call=False : facturé seulement si le paiement a abouti (tx_hash,
+    porté par le résultat ou par l'exception si le signal échoue après paiement).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        price: float,
+        fetch_fn: Callable[[dict], tuple[dict, Optional[str]]] | None = None,
+        address: str | None = None,
+        latency_hint: float = 0.2,
+        error_hint: tuple[float, float] = (0.05, 0.03),
+        kind: str = "remote",
+        pay_per_call: bool = True,
+    ):
+        self.name = name
+        self.price = price
+        self.pay_per_call = pay_per_call
+        self.address = address
+        self.kind = kind
+        self._fetch_fn = fetch_fn
+        self.latency_hint = latency_hint
+        self._lock = threading.Lock()
+        self._latencies: deque[tuple[float, float]] = deque(maxlen=LATENCY_WINDOW)  # (horodatage, latence)
+        self._inflight: dict[int, float] = {}  # id d'appel -> début
+        self._next_call_id = 0
+        self.solar_err, self.price_err = error_hint
+        self.failure_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.scored = 0
+
+    def fetch(self, state: dict) -> tuple[dict, Optional[str]]:
+        return self._fetch_fn(state)
+
+    def timed_fetch(self, state: dict) -> tuple[dict, Optional[str], float]:
+        t0 = time.monotonic()
+        try:
+            with profile_section(f"signal:{self.name}"):
+                data, tx_hash = self.fetch(state)
+        except Exception as e:
+            e.latency = time.monotonic() - t0
+            raise
+        return data, tx_hash, time.monotonic() - t0
+
+    # ---------- online stats ----------
+    def begin_call(self) -> int:
+        with self._lock:
+            self._next_call_id += 1
+            self._inflight[self._next_call_id] = time.monotonic()
+            return self._next_call_id
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._inflight)
+
+    def expected_latency(self) -> float:
+        """
+        p90 des latences des LATENCY_TTL dernières secondes ; les appels encore
+        en vol comptent pour leur durée écoulée (borne basse). Sans échantillon
+        récent, retour au hint.
+        """
+        now = time.monotonic()
+        with self._lock:
+            lat = [l for t, l in self._latencies if now - t <= LATENCY_TTL]
+            lat += [now - t0 for t0 in self._inflight.values()]
+        if not lat:
+            return self.latency_hint
+        lat.sort()
+        return lat[min(len(lat) - 1, int(0.9 * len(lat)))]
+
+    def reliability(self) -> float:
+        return 1.0 - self.failure_rate
+
+    def record(self, state: dict, call_id: int, future):
+        with self._lock:
+            self._inflight.pop(call_id, None)
+            self.calls += 1
+            exc = future.exception()
+            if exc is not None:
+                self.failures += 1
+                self.failure_rate += EWMA_ALPHA * (1.0 - self.failure_rate)
+                self._latencies.append((time.monotonic(), getattr(exc, "latency", 0.0)))
+                return
+            data, _, latency = future.result()
+            self.failure_rate += EWMA_ALPHA * (0.0 - self.failure_rate)
+            self._latencies.append((time.monotonic(), latency))
+            s_err = abs(data["solar"] - state["solar_production"]) / max(state["solar_production"], 1e-9)
+            p_err = abs(data["price"] - state["energy_price"]) / max(state["energy_price"], 1e-9)
+            self.solar_err += EWMA_ALPHA * (s_err - self.solar_err)
+            self.price_err += EWMA_ALPHA * (p_err - self.price_err)
+            self.scored += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "address": self.address,
+            "price": self.price,
+            "latency_samples": len(self._latencies),
+            "in_flight": self.in_flight(),
+            "expected_latency_ms": round(self.expected_latency() * 1000, 1),
+            "solar_err": round(self.solar_err, 4),
+            "price_err": round(self.price_err, 4),
+            "reliability": round(self.reliability(), 4),
+            "calls": self.calls,
+            "failures": self.failures,
+            "scored": self.scored,
+        }
+
+
+class LocalSignalProvider(SignalProvider):
+    """Stand-in local : bruit, latence et pannes simulés (tests / démo sans chaîne)."""
+
+    def __init__(
+        self,
+        name: str,
+        price: float,
+        solar_noise: float,
+        price_noise: float,
+        latency_range: tuple[float, float] = (0.02, 0.08),
+        slow_prob: float = 0.0,
+        slow_latency: float = 3.0,
+        fail_prob: float = 0.0,
+    ):
+        super().__init__(
+            name,
+            price,
+            latency_hint=latency_range[1],
+            error_hint=(solar_noise / 2, price_noise / 2),
+            kind="local",
+        )
+        self.solar_noise = solar_noise
+        self.price_noise = price_noise
+        self.latency_range = latency_range
+        self.slow_prob = slow_prob
+        self.slow_latency = slow_latency
+        self.fail_prob = fail_prob
+
+    def fetch(self, state: dict) -> tuple[dict, Optional[str]]:
+        slow = random.random() < self.slow_prob
+        time.sleep(self.slow_latency if slow else random.uniform(*self.latency_range))
+        if random.random() < self.fail_prob:
+            raise RuntimeError(f"{self.name}: provider unavailable")
+        solar = state["solar_production"] * (1 + random.uniform(-self.solar_noise, self.solar_noise))
+        price = state["energy_price"] * (1 + random.uniform(-self.price_noise, self.price_noise))
+        return {"solar": max(solar, 0.0), "price": max(price, 0.0)}, None
+
+
+def default_local_providers() -> list[SignalProvider]:
+    return [
+        LocalSignalProvider("local-fast", price=0.03, solar_noise=0.08, price_noise=0.05),
+        LocalSignalProvider("local-precise", price=0.06, solar_noise=0.02, price_noise=0.015,
+                            latency_range=(0.15, 0.40)),
+        LocalSignalProvider("local-flaky", price=0.04, solar_noise=0.03, price_noise=0.02,
+                            slow_prob=0.25, fail_prob=0.10),
+    ]
+
+
+def expected_evpi(basic: dict, solar_err: float, price_err: float, reliability: float) -> float:
+    """Même forme que l'EVPI historique, mais sur l'erreur attendue du fournisseur (pas la vérité)."""
+    delta_solar = (BASIC_SOLAR_ERR - solar_err) * basic["solar"]
+    delta_price = (BASIC_PRICE_ERR - price_err) * basic["price"]
+    info_gain = max(0.0, (0.6 * delta_solar + 1.0 * delta_price)) * 0.08
+    return round(reliability * (info_gain + EXPECTED_PENALTY_AVOID), 4)
+
+
+@dataclass
+class Quote:
+    provider: SignalProvider
+    price: float
+    evpi: float
+    expected_latency: float
+
+    @property
+    def score(self) -> float:
+        return self.evpi / self.price if self.price > 0 else float("inf")
+
+
+def _call_tx_hash(future) -> Optional[str]:
+    exc = future.exception()
+    if exc is not None:
+        return getattr(exc, "tx_hash", None)
+    return future.result()[1]
+
+
+@dataclass
+class _Call:
+    quote: Quote
+    detached: bool = False
+
+
+@dataclass
+class Purchase:
+    quote: Optional[Quote] = None
+    data: Optional[dict] = None
+    tx_hash: Optional[str] = None
+    spent: float = 0.0
+    latency: float = 0.0
+    hedges: int = 0
+    launched: list[str] = field(default_factory=list)
+
+
+class SignalMarketplace:
+    def __init__(
+        self,
+        latency_budget: float = SIGNAL_LATENCY_BUDGET,
+        max_hedges: int = SIGNAL_MAX_HEDGES,
+        explore_rate: float = SIGNAL_EXPLORE_RATE,
+    ):
+        self.latency_budget = latency_budget
+        self.max_hedges = max_hedges
+        self.explore_rate = explore_rate
+        self.providers: dict[str, SignalProvider] = {}
+        self._lock = threading.Lock()
+        self._late_charges = 0.0
+
+    def register(self, provider: SignalProvider):
+        self.providers[provider.name] = provider
+
+    def quotes(self, basic: dict) -> list[Quote]:
+        """
+        Candidats compatibles avec le budget de latence, triés par EVPI / coût.
+        Un fournisseur dont un appel d'un epoch précédent est encore en vol
+        n'est pas re-coté (pas d'empilement derrière un paiement lent).
+        Exploration : un fournisseur jamais appelé (sinon, avec probabilité
+        explore_rate, un autre au hasard) passe en tête pour que sa précision
+        soit apprise ; le hedge couvre ce choix.
+        """
+        out = []
+        for p in self.providers.values():
+            if p.in_flight():
+                continue
+            lat = p.expected_latency()
+            if lat > self.latency_budget:
+                continue
+            evpi = expected_evpi(basic, p.solar_err, p.price_err, p.reliability())
+            out.append(Quote(provider=p, price=p.price, evpi=evpi, expected_latency=lat))
+        out.sort(key=lambda q: q.score, reverse=True)
+        if len(out) > 1:
+            untried = [q for q in out[1:] if q.provider.calls == 0]
+            if untried:
+                pick = untried[0]
+            elif random.random() < self.explore_rate:
+                pick = random.choice(out[1:])
+            else:
+                pick = None
+            if pick is not None:
+                out.remove(pick)
+                out.insert(0, pick)
+        return out
+
+    def drain_late_charges(self) -> float:
+        """Paiements on-chain aboutis après la deadline d'un achat précédent."""
+        with self._lock:
+            amount, self._late_charges = self._late_charges, 0.0
+        return round(amount, 4)
+
+    def _settle_late(self, call: _Call, future):
+        with self._lock:
+            if call.detached and not call.quote.provider.pay_per_call and _call_tx_hash(future):
+                self._late_charges += call.quote.price
+
+    def purchase(self, quotes: list[Quote], state: dict, max_spend: float) -> Purchase:
+        """
+        Achète le meilleur quote sous deadline. Si la réponse tarde au-delà de
+        son p90, une requête couverte (hedge) part vers le candidat suivant ;
+        un appel en échec est remplacé immédiatement. Les appels pay-per-call
+        sont payés au lancement, les autres seulement si leur paiement a abouti
+        (après la deadline : via drain_late_charges).
+        """
+        t0 = time.monotonic()
+        deadline = t0 + self.latency_budget
+        candidates = list(quotes)
+        pending: dict = {}
+        result = Purchase()
+        committed = 0.0
+
+        def next_candidate():
+            remaining = deadline - time.monotonic()
+            while candidates:
+                q = candidates.pop(0)
+                if committed + q.price <= max_spend and q.expected_latency <= remaining:
+                    return q
+            return None
+
+        def charge(q: Quote):
+            result.spent = round(result.spent + q.price, 4)
+
+        def launch(q: Quote) -> float:
+            nonlocal committed
+            committed += q.price
+            if q.provider.pay_per_call:
+                charge(q)
+            result.launched.append(q.provider.name)
+            call = _Call(q)
+            # copie du contexte : la session de profilage suit l'appel dans le pool
+            call_id = q.provider.begin_call()
+            fut = _EXECUTOR.submit(contextvars.copy_context().run, q.provider.timed_fetch, state)
+            fut.add_done_callback(partial(q.provider.record, state, call_id))
+            fut.add_done_callback(partial(self._settle_late, call))
+            pending[fut] = call
+            return time.monotonic() + min(q.expected_latency, self.latency_budget / 2)
+
+        def settle(fut, q: Quote):
+            if not q.provider.pay_per_call and _call_tx_hash(fut):
+                charge(q)
+
+        def detach_pending():
+            with self._lock:
+                for fut, call in pending.items():
+                    if fut.done():
+                        settle(fut, call.quote)
+                    else:
+                        call.detached = True
+
+        q = next_candidate()
+        if q is None:
+            return result
+        hedge_at = launch(q)
+
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            can_hedge = result.hedges < self.max_hedges and bool(candidates)
+            until = min(deadline, hedge_at) if can_hedge else deadline
+            done, _ = wait(pending, timeout=max(0.0, until - now), return_when=FIRST_COMPLETED)
+            for fut in done:
+                q = pending.pop(fut).quote
+                settle(fut, q)
+                if fut.exception() is None:
+                    data, tx_hash, _ = fut.result()
+                    result.quote = q
+                    result.data = data
+                    result.tx_hash = tx_hash
+                    result.latency = round(time.monotonic() - t0, 4)
+                    detach_pending()
+                    return result
+            if done:
+                # failover : un appel a échoué, on le remplace sans consommer de hedge
+                q = next_candidate()
+                if q is not None:
+                    hedge_at = launch(q)
+            elif not done and can_hedge and time.monotonic() >= hedge_at:
+                q = next_candidate()
+                if q is not None:
+                    result.hedges += 1
+                    hedge_at = launch(q)
+                else:
+                    hedge_at = deadline
+
+        detach_pending()
+        result.latency = round(time.monotonic() - t0, 4)
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            "latency_budget_s": self.latency_budget,
+            "max_hedges": self.max_hedges,
+            "explore_rate": self.explore_rate,
+            "providers": [p.snapshot() for p in self.providers.values()],
+        }
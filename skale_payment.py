@@ -1,7 +1,10 @@
 # skale_payment.py
 import os
+import threading
 from web3 import Web3
 
+from profiler import profiled
+
 RPC_URL = os.getenv("SKALE_RPC_URL", "https://base-sepolia-testnet.skalenodes.com/v1/bite-v2-sandbox-2")
 CHAIN_ID = int(os.getenv("SKALE_CHAIN_ID", "103698795"))
 
@@ -20,6 +23,12 @@ if SKALE_PAYMENTS_ENABLED:
 else:
     address = "0x0000000000000000000000000000000000000000"
 
+# nonce -> signature -> envoi sérialisés : un paiement x402 encore en vol
+# (hedge du marketplace) ne doit pas partager son nonce avec un déploiement.
+# L'attente du reçu se fait hors verrou pour ne pas bloquer les autres envois.
+_SEND_LOCK = threading.Lock()
+
+@profiled
 def send_payment(to_address: str, amount_ether: float = 0.001):
     """
     Envoie un paiement sur SKALE (si PRIVATE_KEY présente).
@@ -27,20 +36,21 @@ def send_payment(to_address: str, amount_ether: float = 0.001):
     if not SKALE_PAYMENTS_ENABLED:
         raise RuntimeError("SKALE payments disabled (PRIVATE_KEY missing)")
 
-    nonce = w3.eth.get_transaction_count(address)
     amount_wei = w3.to_wei(amount_ether, "ether")
 
-    tx = {
-        "nonce": nonce,
-        "to": w3.to_checksum_address(to_address),
-        "value": amount_wei,
-        "gas": 21000,
-        "gasPrice": w3.to_wei("0.1", "gwei"),
-        "chainId": CHAIN_ID,
-    }
-
-    signed_tx = account.sign_transaction(tx)
-    tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    with _SEND_LOCK:
+        nonce = w3.eth.get_transaction_count(address, "pending")
+        tx = {
+            "nonce": nonce,
+            "to": w3.to_checksum_address(to_address),
+            "value": amount_wei,
+            "gas": 21000,
+            "gasPrice": w3.to_wei("0.1", "gwei"),
+            "chainId": CHAIN_ID,
+        }
+        signed_tx = account.sign_transaction(tx)
+        tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+
     tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
 
     if tx_receipt.status != 1:
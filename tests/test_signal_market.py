@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from signal_market import LocalSignalProvider, Quote, SignalMarketplace, SignalProvider
+
+STATE = {"solar_production": 50.0, "energy_price": 0.10, "consumption": 40.0}
+
+
+def _quotes(*providers):
+    # ordre imposé : le premier est le primaire, les suivants les candidats hedge / failover
+    return [Quote(provider=p, price=p.price, evpi=1.0, expected_latency=p.expected_latency()) for p in providers]
+
+
+def test_hedge_wins_when_primary_is_slow():
+    slow = LocalSignalProvider("slow", price=0.03, solar_noise=0.02, price_noise=0.01,
+                               latency_range=(0.01, 0.02), slow_prob=1.0, slow_latency=0.5)
+    fast = LocalSignalProvider("fast", price=0.04, solar_noise=0.02, price_noise=0.01)
+    market = SignalMarketplace(latency_budget=1.0, max_hedges=1, explore_rate=0.0)
+
+    t0 = time.monotonic()
+    result = market.purchase(_quotes(slow, fast), STATE, max_spend=1.0)
+
+    assert result.quote.provider is fast
+    assert result.hedges == 1
+    assert result.launched == ["slow", "fast"]
+    assert result.spent == 0.07  # stand-ins : chaque appel lancé est payé
+    assert time.monotonic() - t0 < 0.4
+
+
+def test_failed_call_is_replaced_without_using_a_hedge():
+    broken = LocalSignalProvider("broken", price=0.03, solar_noise=0.02, price_noise=0.01,
+                                 latency_range=(0.0, 0.01), fail_prob=1.0)
+    fast = LocalSignalProvider("fast", price=0.04, solar_noise=0.02, price_noise=0.01)
+    market = SignalMarketplace(latency_budget=1.0, max_hedges=0, explore_rate=0.0)
+
+    result = market.purchase(_quotes(broken, fast), STATE, max_spend=1.0)
+
+    assert result.quote.provider is fast
+    assert result.hedges == 0
+    assert result.launched == ["broken", "fast"]
+    time.sleep(0.05)
+    assert broken.failures == 1 and broken.reliability() < 1.0
+
+
+def test_purchase_gives_up_at_the_deadline():
+    slow = LocalSignalProvider("slow", price=0.03, solar_noise=0.02, price_noise=0.01,
+                               latency_range=(0.01, 0.02), slow_prob=1.0, slow_latency=0.5)
+    market = SignalMarketplace(latency_budget=0.2, max_hedges=1, explore_rate=0.0)
+
+    t0 = time.monotonic()
+    result = market.purchase(_quotes(slow), STATE, max_spend=1.0)
+
+    assert result.data is None and result.quote is None
+    assert time.monotonic() - t0 < 0.35
+    # appel encore en vol : le fournisseur n'est pas re-coté
+    assert slow.in_flight() == 1
+    assert market.quotes({"solar": 50.0, "price": 0.10}) == []
+
+
+def test_onchain_payment_settled_after_deadline_is_charged_later():
+    def slow_payment(state):
+        time.sleep(0.3)
+        return {"solar": 50.0, "price": 0.10}, "0xabc"
+
+    oracle = SignalProvider("oracle", price=0.05, fetch_fn=slow_payment,
+                            latency_hint=0.05, pay_per_call=False)
+    market = SignalMarketplace(latency_budget=0.1, max_hedges=0, explore_rate=0.0)
+
+    result = market.purchase(_quotes(oracle), STATE, max_spend=1.0)
+    assert result.data is None
+    assert result.spent == 0.0
+
+    time.sleep(0.4)
+    assert market.drain_late_charges() == 0.05
+    assert market.drain_late_charges() == 0.0
+
+
+def test_onchain_call_failing_before_payment_is_not_charged():
+    def no_key(state):
+        raise RuntimeError("SKALE payments disabled (PRIVATE_KEY missing)")
+
+    oracle = SignalProvider("oracle", price=0.05, fetch_fn=no_key,
+                            latency_hint=0.01, pay_per_call=False)
+    fast = LocalSignalProvider("fast", price=0.03, solar_noise=0.02, price_noise=0.01)
+    market = SignalMarketplace(latency_budget=1.0, max_hedges=0, explore_rate=0.0)
+
+    result = market.purchase(_quotes(oracle, fast), STATE, max_spend=1.0)
+
+    assert result.quote.provider is fast
+    assert result.spent == 0.03